@@ -11,11 +11,19 @@ import json
 import sqlite3
 import threading
 import time
-from datetime import datetime
-from flask import Flask, render_template, request, jsonify
+import uuid
+from collections import Counter, deque
+from datetime import datetime, timedelta
+from flask import Flask, Response, render_template, request, jsonify, stream_with_context
 from flask_socketio import SocketIO, emit
 import logging
 import os
+import re
+
+from config import (DATABASE_PATH, INDEXED_EXTRA_FIELDS, COMPACTION_BATCH_ROWS, COMPACTION_INTERVAL,
+                    COMPACTION_VACUUM_PAGES, DB_WRITE_TIMEOUT, SPOOL_PATH, SPOOL_MAX_BYTES,
+                    SPOOL_FSYNC_INTERVAL, SPOOL_FSYNC_RECORDS, RESUME_BATCH_SIZE)
+from spool import LogSpool
 
 # 创建Flask应用
 app = Flask(__name__)
@@ -29,15 +37,56 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # 全局变量
-log_buffer = []  # 内存中的日志缓冲区
 max_buffer_size = 1000  # 最大缓冲区大小
+log_buffer = deque(maxlen=max_buffer_size)  # 内存中的日志环形缓冲区，按id(提交顺序)递增
+new_log_condition = threading.Condition()  # 写入数据库和追加缓冲区在此锁内完成，并通知实时订阅者
 clients_count = 0  # 连接的客户端数量
+spool = None  # 数据库不可用时的磁盘暂存队列，由init_spool初始化
+
+# 结构化(JSON)日志中直接映射到数据表列的字段，其余字段存入extra列
+STRUCTURED_FIELDS = ('timestamp', 'level', 'tag', 'message', 'app_package', 'hook_point', 'data_type')
+# 结构化日志中常见的级别写法 -> 界面使用的级别 (INFO/WARN/ERROR/DEBUG)
+LEVEL_ALIASES = {
+    'V': 'DEBUG', 'VERBOSE': 'DEBUG', 'TRACE': 'DEBUG', 'D': 'DEBUG', 'DEBUG': 'DEBUG',
+    'I': 'INFO', 'INFO': 'INFO', 'NOTICE': 'INFO',
+    'W': 'WARN', 'WARN': 'WARN', 'WARNING': 'WARN',
+    'E': 'ERROR', 'ERR': 'ERROR', 'ERROR': 'ERROR', 'F': 'ERROR', 'FATAL': 'ERROR',
+    'A': 'ERROR', 'ASSERT': 'ERROR', 'CRITICAL': 'ERROR', 'SEVERE': 'ERROR',
+}
+# extra字段名只允许标识符，避免拼接进JSON路径/列名时出现注入
+EXTRA_FIELD_PATTERN = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+# 汇总表: 粒度 -> (表名, 时间桶长度, 时间桶格式)
+ROLLUP_INTERVALS = {
+    'minute': ('log_rollup_minute', timedelta(minutes=1), '%Y-%m-%dT%H:%M'),
+    'hour': ('log_rollup_hour', timedelta(hours=1), '%Y-%m-%dT%H'),
+}
+# 汇总表的维度列
+ROLLUP_DIMENSIONS = ('level', 'tag', 'app_package', 'source_ip')
+ISO_MINUTE_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}')
+MAX_HISTOGRAM_BUCKETS = 2000
+# 清空日志时旧表重命名为 <表名>_trash_<毫秒时间戳>，由后台压缩任务分批删除
+TRASH_TABLE_MARKER = '_trash_'
+
+def _rollup_minute(timestamp):
+    """返回ISO时间戳所在的分钟桶，格式不对或日期时间无效(如99:99)时返回None"""
+    if not ISO_MINUTE_PATTERN.match(timestamp):
+        return None
+    minute = timestamp[:10] + 'T' + timestamp[11:16]
+    try:
+        datetime.strptime(minute, ROLLUP_INTERVALS['minute'][2])
+    except ValueError:
+        return None
+    return minute
 
 class LogDatabase:
     """日志数据库管理类"""
     
-    def __init__(self, db_path='logs.db'):
+    def __init__(self, db_path='logs.db', write_timeout=DB_WRITE_TIMEOUT):
         self.db_path = db_path
+        self.write_timeout = write_timeout  # 实时写入等待锁的超时，超时则转入暂存
+        self.compaction_thread = None
+        self.compaction_lock = threading.Lock()
         self.init_database()
     
     def init_database(self):
@@ -45,6 +94,21 @@ class LogDatabase:
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
         
+        # 新建数据库启用增量vacuum，便于后台逐步回收空间 (已有数据库上此设置无效)
+        cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        
+        # 键值元数据: generation(表的代数，决定索引名)、cleared_at(最近一次清空的时间)
+        cursor.execute('CREATE TABLE IF NOT EXISTS log_meta (key TEXT PRIMARY KEY, value TEXT)')
+        
+        self._create_logs_table(cursor)
+        self._create_rollup_tables(cursor)
+        
+        conn.commit()
+        conn.close()
+        logger.info("数据库初始化完成")
+    
+    def _create_logs_table(self, cursor):
+        """创建logs表及其索引"""
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS logs (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -57,51 +121,229 @@ class LogDatabase:
                 hook_point TEXT,
                 data_type TEXT,
                 raw_data TEXT,
+                extra TEXT,
+                collector_id TEXT,
+                dedup_key TEXT,
                 created_at DATETIME DEFAULT CURRENT_TIMESTAMP
             )
         ''')
         
-        # 创建索引提高查询性能
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_timestamp ON logs(timestamp)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_level ON logs(level)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_tag ON logs(tag)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_app_package ON logs(app_package)')
+        # 兼容旧数据库：补充新增的列
+        columns = {row[1] for row in cursor.execute('PRAGMA table_xinfo(logs)')}
+        for column in ('extra', 'collector_id', 'dedup_key'):
+            if column not in columns:
+                cursor.execute(f'ALTER TABLE logs ADD COLUMN {column} TEXT')
         
+        self._create_indexes(cursor, columns)
+    
+    def _create_rollup_tables(self, cursor):
+        """创建按分钟/小时汇总的计数表，新建时从现有日志回填"""
+        for table, _, bucket_format in ROLLUP_INTERVALS.values():
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,))
+            exists = cursor.fetchone() is not None
+            
+            cursor.execute(f'''
+                CREATE TABLE IF NOT EXISTS {table} (
+                    bucket TEXT NOT NULL,
+                    level TEXT NOT NULL,
+                    tag TEXT NOT NULL,
+                    app_package TEXT NOT NULL,
+                    source_ip TEXT NOT NULL,
+                    count INTEGER NOT NULL,
+                    PRIMARY KEY (bucket, level, tag, app_package, source_ip)
+                ) WITHOUT ROWID
+            ''')
+            
+            if not exists:
+                bucket_length = len(datetime(2000, 1, 1).strftime(bucket_format))
+                cursor.execute(f'''
+                    INSERT INTO {table}
+                    SELECT substr(timestamp, 1, 10) || 'T' || substr(timestamp, 12, {bucket_length - 11}),
+                           level, COALESCE(tag, ''), COALESCE(app_package, ''), COALESCE(source_ip, ''),
+                           COUNT(*)
+                    FROM logs
+                    WHERE timestamp GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]?[0-9][0-9]:[0-9][0-9]*'
+                      AND strftime('%Y-%m-%d %H:%M', substr(timestamp, 1, 10) || ' ' || substr(timestamp, 12, 5))
+                          = substr(timestamp, 1, 10) || ' ' || substr(timestamp, 12, 5)
+                    GROUP BY 1, 2, 3, 4, 5
+                ''')
+    
+    @staticmethod
+    def _get_meta(cursor, key, default=None):
+        """读取元数据"""
+        cursor.execute('SELECT value FROM log_meta WHERE key = ?', (key,))
+        row = cursor.fetchone()
+        return row[0] if row else default
+    
+    @staticmethod
+    def _set_meta(cursor, key, value):
+        """写入元数据"""
+        cursor.execute('INSERT OR REPLACE INTO log_meta (key, value) VALUES (?, ?)', (key, str(value)))
+    
+    def _create_indexes(self, cursor, columns):
+        """创建索引提高查询性能
+        
+        每一代logs表使用带代数后缀的索引名，清空时旧表连同索引整体改名移走，
+        无需在事务内删除索引；第0代沿用原来的索引名。
+        """
+        generation = int(self._get_meta(cursor, 'generation', 0))
+        suffix = f'_g{generation}' if generation else ''
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_timestamp{suffix} ON logs(timestamp)')
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_level{suffix} ON logs(level)')
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_tag{suffix} ON logs(tag)')
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_app_package{suffix} ON logs(app_package)')
+        # 暂存回放/转发重传的去重键，NULL不参与唯一约束
+        cursor.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS idx_dedup_key{suffix} ON logs(dedup_key)')
+        
+        # 为配置的extra字段建立生成列索引
+        self.indexed_extra_fields = set()
+        for field in INDEXED_EXTRA_FIELDS:
+            if self._create_extra_index(cursor, columns, field, suffix):
+                self.indexed_extra_fields.add(field)
+    
+    def create_indexes(self):
+        """(重新)创建logs表的索引，用于批量导入完成后"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        columns = {row[1] for row in cursor.execute('PRAGMA table_xinfo(logs)')}
+        self._create_indexes(cursor, columns)
         conn.commit()
         conn.close()
-        logger.info("数据库初始化完成")
     
-    def insert_log(self, log_data):
-        """插入日志记录"""
+    def drop_indexes(self):
+        """删除logs表的二级索引，批量导入前调用以避免逐行维护索引
+        
+        去重键的唯一索引是写入语句ON CONFLICT的依据，保留不删。
+        """
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'logs' AND sql IS NOT NULL "
+            "AND name NOT LIKE 'idx\\_dedup\\_key%' ESCAPE '\\'"
+        )
+        for (name,) in cursor.fetchall():
+            cursor.execute(f'DROP INDEX IF EXISTS "{name}"')
+        conn.commit()
+        conn.close()
+    
+    def _create_extra_index(self, cursor, columns, field, suffix=''):
+        """为extra中的字段创建虚拟生成列及索引"""
+        if not EXTRA_FIELD_PATTERN.match(field):
+            logger.warning(f"忽略非法的extra索引字段: {field}")
+            return False
+        
+        try:
+            if f'extra_{field}' not in columns:
+                cursor.execute(f'''
+                    ALTER TABLE logs ADD COLUMN extra_{field} TEXT
+                    GENERATED ALWAYS AS (json_extract(extra, '$.{field}')) VIRTUAL
+                ''')
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_extra_{field}{suffix} ON logs(extra_{field})')
+            return True
+        except sqlite3.OperationalError as e:
+            # 旧版SQLite不支持生成列，退化为json_extract全表过滤
+            logger.warning(f"创建extra字段索引失败({field}): {e}")
+            return False
+    
+    # id由SQLite在提交时分配，写入锁保证id顺序即提交顺序；
+    # 只有去重键冲突(暂存回放/转发重传的重复记录)时跳过
+    INSERT_SQL = '''
+        INSERT INTO logs (timestamp, level, tag, message, source_ip, 
+                        app_package, hook_point, data_type, raw_data, extra, collector_id, dedup_key)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (dedup_key) DO NOTHING
+    '''
+    
+    @staticmethod
+    def _log_row(log_data):
+        """将日志字典转换为logs表的插入参数"""
+        return (
+            log_data.get('timestamp', ''),
+            log_data.get('level', 'INFO'),
+            log_data.get('tag', ''),
+            log_data.get('message', ''),
+            log_data.get('source_ip', ''),
+            log_data.get('app_package', ''),
+            log_data.get('hook_point', ''),
+            log_data.get('data_type', ''),
+            log_data.get('raw_data', ''),
+            json.dumps(log_data['extra'], ensure_ascii=False) if log_data.get('extra') else None,
+            log_data.get('collector_id', ''),
+            log_data.get('dedup_key')
+        )
+    
+    @staticmethod
+    def _update_rollups(cursor, log_list):
+        """在写入日志的同一事务中累加分钟/小时汇总计数"""
+        counters = {interval: Counter() for interval in ROLLUP_INTERVALS}
+        now = None
+        for log_data in log_list:
+            timestamp = str(log_data.get('timestamp') or '')
+            minute = _rollup_minute(timestamp)
+            if minute is None:
+                now = now or datetime.now().strftime(ROLLUP_INTERVALS['minute'][2])
+                minute = now
+            dimensions = tuple(log_data.get(name) or '' for name in ROLLUP_DIMENSIONS)
+            counters['minute'][(minute,) + dimensions] += 1
+            counters['hour'][(minute[:13],) + dimensions] += 1
+        
+        for interval, counter in counters.items():
+            table = ROLLUP_INTERVALS[interval][0]
+            cursor.executemany(f'''
+                INSERT INTO {table} (bucket, level, tag, app_package, source_ip, count)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (bucket, level, tag, app_package, source_ip)
+                DO UPDATE SET count = count + excluded.count
+            ''', [key + (count,) for key, count in counter.items()])
+    
+    def write_logs(self, log_list, timeout=None):
+        """在单个事务中写入日志，失败时抛出异常
+        
+        写入成功的记录会被设置id；返回实际写入的记录 (不含去重跳过的重复记录)。
+        """
+        if not log_list:
+            return []
+        conn = sqlite3.connect(self.db_path, timeout=self.write_timeout if timeout is None else timeout)
         try:
-            conn = sqlite3.connect(self.db_path)
             cursor = conn.cursor()
-            
-            cursor.execute('''
-                INSERT INTO logs (timestamp, level, tag, message, source_ip, 
-                                app_package, hook_point, data_type, raw_data)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                log_data.get('timestamp', ''),
-                log_data.get('level', 'INFO'),
-                log_data.get('tag', ''),
-                log_data.get('message', ''),
-                log_data.get('source_ip', ''),
-                log_data.get('app_package', ''),
-                log_data.get('hook_point', ''),
-                log_data.get('data_type', ''),
-                log_data.get('raw_data', '')
-            ))
-            
+            inserted = []
+            for log_data in log_list:
+                cursor.execute(self.INSERT_SQL, self._log_row(log_data))
+                if cursor.rowcount == 1:
+                    log_data['id'] = cursor.lastrowid
+                    inserted.append(log_data)
+                elif not log_data.get('dedup_key'):
+                    raise sqlite3.IntegrityError('日志未写入数据库')
+            # 只统计实际写入的记录
+            self._update_rollups(cursor, inserted)
             conn.commit()
+            return inserted
+        finally:
             conn.close()
+    
+    def insert_log(self, log_data):
+        """插入日志记录"""
+        try:
+            self.write_logs([log_data])
             return True
         except Exception as e:
             logger.error(f"插入日志失败: {e}")
             return False
     
-    def get_logs(self, limit=100, offset=0, level_filter=None, search_text=None):
-        """获取日志记录"""
+    def insert_logs(self, log_list):
+        """在单个事务中批量插入日志记录"""
+        try:
+            self.write_logs(log_list, timeout=5.0)
+            return True
+        except Exception as e:
+            logger.error(f"批量插入日志失败: {e}")
+            return False
+    
+    def get_logs(self, limit=100, offset=0, level_filter=None, search_text=None, extra_filters=None):
+        """获取日志记录
+        
+        extra_filters: {字段名: 值}，按结构化日志extra中的字段精确过滤
+        """
         try:
             conn = sqlite3.connect(self.db_path)
             cursor = conn.cursor()
@@ -119,11 +361,30 @@ class LogDatabase:
                 search_pattern = f'%{search_text}%'
                 params.extend([search_pattern, search_pattern, search_pattern])
             
+            for field, value in (extra_filters or {}).items():
+                if not EXTRA_FIELD_PATTERN.match(field):
+                    logger.warning(f"忽略非法的extra过滤字段: {field}")
+                    continue
+                if value in ('true', 'false'):
+                    # JSON布尔值经json_extract后变为1/0，按json_type匹配，同时兼容字符串"true"/"false"
+                    where_conditions.append(
+                        f"(json_type(extra, '$.{field}') = ? OR "
+                        f"(json_type(extra, '$.{field}') = 'text' AND json_extract(extra, '$.{field}') = ?))"
+                    )
+                    params.extend([value, value])
+                    continue
+                # 已建索引的字段走生成列，否则直接json_extract
+                if field in self.indexed_extra_fields:
+                    where_conditions.append(f'extra_{field} = ?')
+                else:
+                    where_conditions.append(f"CAST(json_extract(extra, '$.{field}') AS TEXT) = ?")
+                params.append(value)
+            
             where_clause = ' WHERE ' + ' AND '.join(where_conditions) if where_conditions else ''
             
             query = f'''
                 SELECT id, timestamp, level, tag, message, source_ip, 
-                       app_package, hook_point, data_type, raw_data, created_at
+                       app_package, hook_point, data_type, raw_data, extra, collector_id, created_at
                 FROM logs 
                 {where_clause}
                 ORDER BY created_at DESC 
@@ -135,6 +396,8 @@ class LogDatabase:
             
             columns = [description[0] for description in cursor.description]
             logs = [dict(zip(columns, row)) for row in cursor.fetchall()]
+            for log in logs:
+                log['extra'] = json.loads(log['extra']) if log['extra'] else {}
             
             conn.close()
             return logs
@@ -142,6 +405,38 @@ class LogDatabase:
             logger.error(f"获取日志失败: {e}")
             return []
     
+    def get_logs_after(self, since_id, limit=500):
+        """按id顺序获取since_id之后的日志，用于断线重连后补发"""
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT id, timestamp, level, tag, message, source_ip, 
+                       app_package, hook_point, data_type, raw_data, extra, collector_id, created_at
+                FROM logs
+                WHERE id > ?
+                ORDER BY id
+                LIMIT ?
+            ''', (since_id, limit))
+            
+            columns = [description[0] for description in cursor.description]
+            logs = [dict(zip(columns, row)) for row in cursor.fetchall()]
+            for log in logs:
+                log['extra'] = json.loads(log['extra']) if log['extra'] else {}
+            
+            conn.close()
+            return logs
+        except Exception as e:
+            logger.error(f"获取增量日志失败: {e}")
+            return []
+    
+    def get_last_log_id(self):
+        """获取已入库的最大日志id"""
+        conn = sqlite3.connect(self.db_path)
+        last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM logs').fetchone()[0]
+        conn.close()
+        return last_id
+    
     def get_log_stats(self):
         """获取日志统计信息"""
         try:
@@ -176,27 +471,288 @@ class LogDatabase:
             logger.error(f"获取统计信息失败: {e}")
             return {}
     
+    def get_histogram(self, interval, start, end, filters=None, group_by=None):
+        """从汇总表获取按时间桶统计的日志数量
+        
+        interval: minute/hour
+        start/end: datetime，闭区间
+        filters: {维度: 值}，维度为level/tag/app_package/source_ip
+        group_by: 按某个维度拆分序列，为空时只返回总数
+        """
+        table, step, bucket_format = ROLLUP_INTERVALS[interval]
+        
+        # 生成完整的时间桶序列，没有日志的桶补0
+        if interval == 'minute':
+            current = start.replace(second=0, microsecond=0)
+        else:
+            current = start.replace(minute=0, second=0, microsecond=0)
+        # 先计算桶数量再生成序列，过大的时间范围直接拒绝
+        bucket_count = (end - current) // step + 1 if current <= end else 0
+        if bucket_count > MAX_HISTOGRAM_BUCKETS:
+            raise ValueError(f'时间桶数量超过上限 {MAX_HISTOGRAM_BUCKETS}')
+        buckets = [(current + step * index).strftime(bucket_format) for index in range(bucket_count)]
+        if not buckets:
+            return {'interval': interval, 'buckets': [], 'series': {}}
+        
+        where_conditions = ['bucket >= ?', 'bucket <= ?']
+        params = [buckets[0], buckets[-1]]
+        for name, value in (filters or {}).items():
+            if name not in ROLLUP_DIMENSIONS:
+                raise ValueError(f'不支持的过滤维度: {name}')
+            where_conditions.append(f'{name} = ?')
+            params.append(value)
+        
+        if group_by and group_by not in ROLLUP_DIMENSIONS:
+            raise ValueError(f'不支持的分组维度: {group_by}')
+        group_column = group_by or "'total'"
+        
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT bucket, {group_column}, SUM(count)
+            FROM {table}
+            WHERE {' AND '.join(where_conditions)}
+            GROUP BY bucket, {group_column}
+        ''', params)
+        rows = cursor.fetchall()
+        conn.close()
+        
+        positions = {bucket: index for index, bucket in enumerate(buckets)}
+        series = {}
+        for bucket, group, count in rows:
+            # 跳过不在序列中的桶 (旧版本写入的非法时间戳)
+            position = positions.get(bucket)
+            if position is not None:
+                series.setdefault(group, [0] * len(buckets))[position] = count
+        
+        return {'interval': interval, 'buckets': buckets, 'series': series}
+    
     def clear_all_logs(self):
-        """清空所有日志"""
+        """清空所有日志
+        
+        logs表和汇总表整体重命名后换上新表，事务内只有改名和建空表，
+        不删除索引或数据；旧表由后台压缩任务分批删除并回收空间。
+        """
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = sqlite3.connect(self.db_path, isolation_level=None)
             cursor = conn.cursor()
-            cursor.execute('DELETE FROM logs')
-            conn.commit()
-            conn.close()
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                trash_suffix = f'{TRASH_TABLE_MARKER}{int(time.time() * 1000)}'
+                trash_table = f'logs{trash_suffix}'
+                cursor.execute(f'ALTER TABLE logs RENAME TO {trash_table}')
+                for table, _, _ in ROLLUP_INTERVALS.values():
+                    cursor.execute(f'ALTER TABLE {table} RENAME TO {table}{trash_suffix}')
+                
+                # 旧索引随旧表保留，新表使用下一代的索引名
+                generation = int(self._get_meta(cursor, 'generation', 0)) + 1
+                self._set_meta(cursor, 'generation', generation)
+                # 清空之前暂存的日志回放时丢弃，避免已清空的日志重新出现
+                self._set_meta(cursor, 'cleared_at', time.time())
+                
+                self._create_logs_table(cursor)
+                # 新表的id接着旧表继续递增，已连接客户端的断点续传位置仍然有效
+                cursor.execute(
+                    "INSERT INTO sqlite_sequence (name, seq) SELECT 'logs', seq FROM sqlite_sequence WHERE name = ?",
+                    (trash_table,)
+                )
+                self._create_rollup_tables(cursor)
+                cursor.execute('COMMIT')
+            except Exception:
+                cursor.execute('ROLLBACK')
+                raise
+            finally:
+                conn.close()
+            
+            self.start_compaction()
             logger.info("数据库日志已清空")
             return True
         except Exception as e:
             logger.error(f"清空数据库日志失败: {e}")
             return False
+    
+    def get_cleared_at(self):
+        """获取最近一次清空日志的时间 (Unix时间戳)，从未清空时返回0"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return float(self._get_meta(conn.cursor(), 'cleared_at', 0))
+        finally:
+            conn.close()
+    
+    def start_compaction(self):
+        """启动后台压缩线程 (已在运行则忽略)
+        
+        只应由负责清空日志的进程(Web应用)调用，避免多个进程争抢同一批旧表。
+        """
+        with self.compaction_lock:
+            if self.compaction_thread and self.compaction_thread.is_alive():
+                return
+            self.compaction_thread = threading.Thread(target=self._compaction_worker, daemon=True)
+            self.compaction_thread.start()
+    
+    def _compaction_worker(self):
+        """分批删除旧表数据并回收空间，数据库繁忙时稍后重试"""
+        dropped = False
+        while True:
+            try:
+                conn = sqlite3.connect(self.db_path)
+                try:
+                    dropped = self._drop_trash_tables(conn) or dropped
+                    self._reclaim_space(conn, dropped)
+                finally:
+                    conn.close()
+                return
+            except Exception as e:
+                if not is_transient_db_error(e):
+                    logger.error(f"后台压缩失败: {e}")
+                    return
+                logger.warning(f"后台压缩时数据库繁忙，稍后重试: {e}")
+                time.sleep(max(COMPACTION_INTERVAL, 1.0))
+    
+    def _drop_trash_tables(self, conn):
+        """分批删除旧表数据后删除旧表，每批之间休眠以限制对写入的影响，返回是否删除了旧表"""
+        cursor = conn.cursor()
+        dropped = False
+        while True:
+            cursor.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE ? ESCAPE '\\'",
+                ('%' + TRASH_TABLE_MARKER.replace('_', '\\_') + '%',)
+            )
+            trash_tables = [row[0] for row in cursor.fetchall()]
+            if not trash_tables:
+                return dropped
+            
+            for table in trash_tables:
+                # 汇总表是WITHOUT ROWID表，按主键分批删除
+                key = 'rowid' if table.startswith('logs') else ', '.join(('bucket',) + ROLLUP_DIMENSIONS)
+                cursor.execute(f'''
+                    DELETE FROM "{table}" WHERE ({key}) IN (
+                        SELECT {key} FROM "{table}" LIMIT ?
+                    )
+                ''', (COMPACTION_BATCH_ROWS,))
+                if cursor.rowcount == 0:
+                    cursor.execute(f'DROP TABLE "{table}"')
+                    dropped = True
+                    logger.info(f"旧日志表已删除: {table}")
+                conn.commit()
+            time.sleep(COMPACTION_INTERVAL)
+    
+    def _reclaim_space(self, conn, dropped):
+        """回收空闲页，使数据库文件变小"""
+        cursor = conn.cursor()
+        auto_vacuum = cursor.execute('PRAGMA auto_vacuum').fetchone()[0]
+        if auto_vacuum == 0:
+            if dropped:
+                # 旧版本创建的数据库未启用增量vacuum，执行一次VACUUM转换，之后改为增量回收
+                logger.info("正在执行一次性VACUUM以回收空间并启用增量vacuum...")
+                cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+                cursor.execute('VACUUM')
+                logger.info("VACUUM完成")
+            return
+        
+        # 增量vacuum分批归还空闲页
+        while auto_vacuum == 2 and cursor.execute('PRAGMA freelist_count').fetchone()[0] > 0:
+            cursor.execute(f'PRAGMA incremental_vacuum({COMPACTION_VACUUM_PAGES})').fetchall()
+            conn.commit()
+            time.sleep(COMPACTION_INTERVAL)
+
+# 数据库在首次使用时初始化，仅导入本模块(如批量导入的解析子进程)时不创建数据库
+db = None
+db_lock = threading.Lock()
+
+def get_db():
+    """获取全局数据库实例"""
+    global db
+    if db is None:
+        with db_lock:
+            if db is None:
+                db = LogDatabase(DATABASE_PATH)
+    return db
 
-# 初始化数据库
-db = LogDatabase()
+def is_transient_db_error(error):
+    """数据库锁定/繁忙/磁盘满等可重试的错误；其余错误(如字段类型无法绑定)重试也不会成功"""
+    if not isinstance(error, sqlite3.OperationalError):
+        return False
+    message = str(error).lower()
+    return any(keyword in message for keyword in ('locked', 'busy', 'full', 'disk i/o', 'unable to open'))
+
+def init_spool(path=SPOOL_PATH):
+    """初始化磁盘暂存队列，并回放上次遗留的暂存日志
+    
+    每个写入进程需要使用独立的暂存文件。
+    """
+    global spool
+    spool = LogSpool(
+        path,
+        _replay_spooled_logs,
+        max_bytes=SPOOL_MAX_BYTES,
+        fsync_interval=SPOOL_FSYNC_INTERVAL,
+        fsync_records=SPOOL_FSYNC_RECORDS,
+        is_transient=is_transient_db_error
+    )
+    return spool
+
+def parse_structured_payload(raw_data):
+    """检测结构化(JSON对象)日志，返回解析后的dict，否则返回None"""
+    text = raw_data.strip()
+    if not (text.startswith('{') and text.endswith('}')):
+        return None
+    try:
+        payload = json.loads(text)
+    except json.JSONDecodeError:
+        return None
+    return payload if isinstance(payload, dict) else None
+
+def _normalize_timestamp(value):
+    """将结构化日志中的时间戳统一为ISO格式字符串"""
+    if isinstance(value, bool) or value is None or value == '':
+        return datetime.now().isoformat()
+    if isinstance(value, (int, float)):
+        # 兼容秒级和毫秒级时间戳
+        seconds = value / 1000 if value > 1e11 else value
+        try:
+            return datetime.fromtimestamp(seconds).isoformat()
+        except (OverflowError, OSError, ValueError):
+            return datetime.now().isoformat()
+    return str(value)
+
+def normalize_level(value):
+    """将日志级别统一为INFO/WARN/ERROR/DEBUG，无法识别时为INFO"""
+    return LEVEL_ALIASES.get(str(value or '').strip().upper(), 'INFO')
+
+def process_structured_log(payload, raw_data, source_ip):
+    """处理结构化日志 - 已知字段直接映射到列，跳过文本分类"""
+    log_data = {
+        'timestamp': _normalize_timestamp(payload.get('timestamp')),
+        'level': normalize_level(payload.get('level')),
+        'tag': str(payload.get('tag') or 'Xposed'),
+        'message': payload.get('message', raw_data.strip()),
+        'source_ip': source_ip,
+        'raw_data': raw_data
+    }
+    if not isinstance(log_data['message'], str):
+        log_data['message'] = json.dumps(log_data['message'], ensure_ascii=False)
+    
+    for field in ('app_package', 'hook_point', 'data_type'):
+        if payload.get(field) is not None:
+            log_data[field] = str(payload[field])
+    
+    # source_ip/raw_data等由服务端决定，不允许被payload覆盖，统一放入extra
+    extra = {key: value for key, value in payload.items() if key not in STRUCTURED_FIELDS}
+    if extra:
+        log_data['extra'] = extra
+    
+    return log_data
 
 def process_xposed_log(raw_data, source_ip):
     """处理Xposed日志数据 - 优化文本处理"""
     try:
-        # 首先尝试作为纯文本处理（大多数情况）
+        # 结构化日志走快速路径
+        payload = parse_structured_payload(raw_data)
+        if payload is not None:
+            return process_structured_log(payload, raw_data, source_ip)
+        
+        # 作为纯文本处理（大多数情况）
         message = raw_data.strip()
         
         # 初始化日志数据
@@ -242,7 +798,6 @@ def process_xposed_log(raw_data, source_ip):
             log_data['tag'] = 'Sensitive'
         
         # 检查手机号正则
-        import re
         if re.search(r'1[3-9]\d{9}', message):
             log_data['data_type'] = 'sensitive'
             log_data['level'] = 'WARN'
@@ -252,18 +807,6 @@ def process_xposed_log(raw_data, source_ip):
         if any(keyword in message_lower for keyword in ['hook', 'frida', 'xposed', '拦截', '注入']):
             log_data['tag'] = 'Hook'
         
-        # 最后尝试JSON解析（备用）
-        if raw_data.startswith('{') and raw_data.endswith('}'):
-            try:
-                json_data = json.loads(raw_data)
-                # 如果是JSON，合并数据
-                log_data.update(json_data)
-                log_data['source_ip'] = source_ip  # 保持source_ip
-                log_data['raw_data'] = raw_data
-            except json.JSONDecodeError:
-                # JSON解析失败，继续使用文本解析结果
-                pass
-        
         return log_data
         
     except Exception as e:
@@ -278,28 +821,93 @@ def process_xposed_log(raw_data, source_ip):
             'raw_data': raw_data
         }
 
+def _publish_logs(log_list):
+    """将已入库的日志加入缓冲区并通知订阅者 (需持有new_log_condition)"""
+    log_buffer.extend(log_list)
+    new_log_condition.notify_all()
+
+def _emit_logs(log_list):
+    """实时推送到Web客户端"""
+    if clients_count > 0:
+        for log_data in log_list:
+            socketio.emit('new_log', log_data)
+
+def _store_logs(log_list):
+    """写入数据库并按提交顺序推送；数据库不可用时进入暂存，返回是否已入库或暂存
+    
+    日志id由数据库在写入时分配，写入和追加缓冲区在同一把锁内完成，
+    保证缓冲区和推送的顺序与id一致。暂存的日志在回放入库后才分配id并推送。
+    """
+    with new_log_condition:
+        if spool is None or not spool.pending:
+            try:
+                inserted = get_db().write_logs(log_list)
+                _publish_logs(inserted)
+            except Exception as e:
+                if spool is None:
+                    logger.error(f"插入日志失败: {e}")
+                    return False
+                logger.warning(f"写入数据库失败，日志转入暂存: {e}")
+            else:
+                _emit_logs(inserted)
+                return True
+        
+        # 暂存中还有积压时直接追加到暂存以保持顺序
+        spooled_at = time.time()
+        for log_data in log_list:
+            # 去重键保证崩溃后重复回放的记录不会重复入库
+            log_data.setdefault('dedup_key', uuid.uuid4().hex)
+            # 暂存时间用于回放时丢弃清空之前的日志
+            log_data['spooled_at'] = spooled_at
+        if not spool.append_many(log_list):
+            logger.error(f"暂存文件已满，{len(log_list)} 条日志被丢弃")
+            return False
+        return True
+
+def _replay_spooled_logs(log_list):
+    """暂存回放：写入数据库后按提交顺序推送，失败时抛出异常由暂存队列决定重试或隔离"""
+    with new_log_condition:
+        # 清空操作可能发生在其他进程，每批回放前从数据库读取清空时间
+        cleared_at = get_db().get_cleared_at()
+        replay_list = [{key: value for key, value in log_data.items() if key != 'spooled_at'}
+                       for log_data in log_list if log_data.get('spooled_at', 0) >= cleared_at]
+        if len(replay_list) < len(log_list):
+            logger.info(f"丢弃清空之前暂存的日志 {len(log_list) - len(replay_list)} 条")
+        inserted = get_db().write_logs(replay_list, timeout=5.0)
+        _publish_logs(inserted)
+    _emit_logs(inserted)
+
 def add_log_to_system(raw_data, source_ip='unknown'):
     """添加日志到系统"""
-    global log_buffer
-    
     # 处理日志数据
     log_data = process_xposed_log(raw_data, source_ip)
     if not log_data:
         return
     
-    # 添加到内存缓冲区
-    log_buffer.append(log_data)
-    if len(log_buffer) > max_buffer_size:
-        log_buffer.pop(0)  # 移除最老的日志
+    _store_logs([log_data])
     
-    # 保存到数据库
-    db.insert_log(log_data)
+    logger.info(f"新日志: [{log_data['level']}] {log_data['message'][:50]}...")
+
+def add_logs_to_system(log_list):
+    """批量添加已解析的日志 (边缘采集节点转发)，全部入库或进入暂存后返回True"""
+    if not log_list:
+        return True
     
-    # 实时推送到Web客户端
-    if clients_count > 0:
-        socketio.emit('new_log', log_data, broadcast=True)
+    saved = _store_logs(log_list)
+    logger.info(f"收到转发日志 {len(log_list)} 条")
+    return saved
+
+def get_logs_after(since_id, limit=RESUME_BATCH_SIZE):
+    """获取since_id之后的日志
     
-    logger.info(f"新日志: [{log_data['level']}] {log_data['message'][:50]}...")
+    缓冲区中的id从since_id起连续时直接返回；出现空缺(其他进程写入的日志、
+    缓冲区已淘汰的旧日志)时从数据库按id范围读取，id即提交顺序，不会遗漏。
+    """
+    snapshot = list(log_buffer)
+    buffered = [log for log in snapshot if log['id'] > since_id][:limit]
+    if buffered and all(log['id'] == since_id + 1 + index for index, log in enumerate(buffered)):
+        return buffered
+    return get_db().get_logs_after(since_id, limit)
 
 # ==================== Web路由 ====================
 
@@ -317,18 +925,31 @@ def api_logs():
         level_filter = request.args.get('level', 'ALL')
         search_text = request.args.get('search', '')
         
+        # extra.<字段名>=<值> 按结构化日志的扩展字段过滤
+        extra_filters = {}
+        for key, value in request.args.items():
+            if key.startswith('extra.'):
+                field = key[len('extra.'):]
+                if not EXTRA_FIELD_PATTERN.match(field):
+                    return jsonify({'success': False, 'error': f'非法的extra字段名: {field}'})
+                extra_filters[field] = value
+        
         offset = (page - 1) * per_page
         
-        logs = db.get_logs(
+        # 查询前的最大id作为客户端断线续传的起点 (页面可能经过过滤，不能用页面中的最大id)
+        last_id = get_db().get_last_log_id()
+        logs = get_db().get_logs(
             limit=per_page, 
             offset=offset, 
             level_filter=level_filter,
-            search_text=search_text
+            search_text=search_text,
+            extra_filters=extra_filters
         )
         
         return jsonify({
             'success': True,
             'logs': logs,
+            'last_id': last_id,
             'page': page,
             'per_page': per_page
         })
@@ -341,9 +962,11 @@ def api_logs():
 def api_stats():
     """获取统计信息API"""
     try:
-        stats = db.get_log_stats()
+        stats = get_db().get_log_stats()
         stats['buffer_size'] = len(log_buffer)
         stats['clients_connected'] = clients_count
+        if spool is not None:
+            stats['spool'] = spool.get_stats()
         
         return jsonify({
             'success': True,
@@ -354,6 +977,88 @@ def api_stats():
         logger.error(f"获取统计API失败: {e}")
         return jsonify({'success': False, 'error': str(e)})
 
+def _parse_time_arg(value):
+    """解析时间参数，支持ISO格式和Unix时间戳(秒)，统一转换为本地时间(不带时区)"""
+    try:
+        return datetime.fromtimestamp(float(value))
+    except ValueError:
+        pass
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f'无法解析的时间参数: {value}')
+    if parsed.tzinfo is not None:
+        # 日志时间戳按本地时间存储，带时区的参数先换算成本地时间
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed
+
+@app.route('/api/histogram')
+def api_histogram():
+    """按时间桶统计日志数量API (读取汇总表)"""
+    try:
+        interval = request.args.get('interval', 'minute')
+        if interval not in ROLLUP_INTERVALS:
+            return jsonify({'success': False, 'error': f'不支持的时间粒度: {interval}'})
+        
+        end = _parse_time_arg(request.args['end']) if request.args.get('end') else datetime.now()
+        if request.args.get('start'):
+            start = _parse_time_arg(request.args['start'])
+        else:
+            # 默认: 分钟粒度最近1小时，小时粒度最近24小时
+            start = end - (timedelta(hours=1) if interval == 'minute' else timedelta(days=1))
+        
+        filters = {name: request.args[name] for name in ROLLUP_DIMENSIONS if request.args.get(name)}
+        group_by = request.args.get('group_by', 'level') or None
+        
+        histogram = get_db().get_histogram(interval, start, end, filters=filters, group_by=group_by)
+        
+        return jsonify({
+            'success': True,
+            'histogram': histogram
+        })
+    
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)})
+    except Exception as e:
+        logger.error(f"获取直方图API失败: {e}")
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/stream')
+def api_stream():
+    """SSE实时日志流，支持since_id参数或Last-Event-ID请求头断点续传"""
+    since_id = request.args.get('since_id') or request.headers.get('Last-Event-ID')
+    if since_id:
+        try:
+            since_id = int(since_id)
+        except ValueError:
+            return jsonify({'success': False, 'error': f'非法的since_id: {since_id}'})
+    else:
+        # 未指定位置时只推送新日志
+        since_id = log_buffer[-1]['id'] if log_buffer else get_db().get_last_log_id()
+    
+    def generate(last_id):
+        idle_polls = 0
+        while True:
+            batch = get_logs_after(last_id)
+            for log in batch:
+                yield f"id: {log['id']}\nevent: log\ndata: {json.dumps(log, ensure_ascii=False)}\n\n"
+            if batch:
+                last_id = batch[-1]['id']
+                idle_polls = 0
+                continue
+            
+            # 其他进程写入的日志不会触发通知，因此每秒回到数据库检查一次
+            with new_log_condition:
+                if not log_buffer or log_buffer[-1]['id'] <= last_id:
+                    new_log_condition.wait(timeout=1)
+            idle_polls += 1
+            if idle_polls >= 15:
+                idle_polls = 0
+                yield ': keepalive\n\n'
+    
+    return Response(stream_with_context(generate(since_id)), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/api/test')
 def api_test():
     """测试API - 添加测试日志"""
@@ -376,14 +1081,11 @@ def api_test():
 def api_clear_logs():
     """清空所有日志"""
     try:
-        global log_buffer
-        
-        # 清空内存缓冲区
-        log_buffer.clear()
-        
-        # 清空数据库
-        if not db.clear_all_logs():
-            return jsonify({'success': False, 'error': '清空数据库失败'})
+        # 在写入锁内清空数据库和内存缓冲区，避免清空期间写入的日志只留在其中一处
+        with new_log_condition:
+            if not get_db().clear_all_logs():
+                return jsonify({'success': False, 'error': '清空数据库失败'})
+            log_buffer.clear()
         
         # 通知所有客户端清空显示
         socketio.emit('clear_logs')
@@ -415,9 +1117,27 @@ def handle_disconnect():
 @socketio.on('request_recent_logs')
 def handle_request_recent_logs():
     """请求最近的日志"""
-    recent_logs = log_buffer[-10:] if log_buffer else []
+    recent_logs = list(log_buffer)[-10:]
     emit('recent_logs', recent_logs)
 
+@socketio.on('resume')
+def handle_resume(data):
+    """断线重连后补发since_id之后的日志，分批发送，结束后客户端切回实时推送"""
+    try:
+        since_id = int((data or {}).get('since_id', 0))
+    except (TypeError, ValueError):
+        emit('resume_complete', {'success': False, 'error': '非法的since_id'})
+        return
+    while True:
+        batch = get_logs_after(since_id)
+        if not batch:
+            break
+        emit('resume_logs', {'logs': batch})
+        since_id = batch[-1]['id']
+        if len(batch) < RESUME_BATCH_SIZE:
+            break
+    emit('resume_complete', {'last_id': since_id})
+
 # ==================== 启动函数 ====================
 
 def create_directories():
@@ -428,6 +1148,9 @@ def create_directories():
 
 if __name__ == '__main__':
     create_directories()
+    init_spool()
+    # 清空日志由Web应用负责，旧表的压缩也只在这里进行 (继续上次未完成的压缩)
+    get_db().start_compaction()
     
     # 设置控制台编码以支持emoji (Windows兼容)
     try:
@@ -445,7 +1168,7 @@ if __name__ == '__main__':
         print("=" * 50)
         print(f"📊 Web界面: http://localhost:5000")
         print(f"📡 UDP服务: 需要单独启动 udp_server.py")
-        print(f"💾 数据库: {db.db_path}")
+        print(f"💾 数据库: {get_db().db_path}")
         print("=" * 50)
     except UnicodeEncodeError:
         # 如果emoji显示失败，使用纯文本版本
@@ -454,7 +1177,7 @@ if __name__ == '__main__':
         print("=" * 50)
         print(f">>> Web界面: http://localhost:5000")
         print(f">>> UDP服务: 需要单独启动 udp_server.py")
-        print(f">>> 数据库: {db.db_path}")
+        print(f">>> 数据库: {get_db().db_path}")
         print("=" * 50)
     
     # 启动Web服务
@@ -15,6 +15,28 @@ UDP_PORT = int(os.getenv('UDP_PORT', 9999))
 # 数据库配置
 DATABASE_PATH = os.getenv('DATABASE_PATH', 'logs.db')
 MAX_LOGS = int(os.getenv('MAX_LOGS', 10000))
+# 结构化日志extra中需要建立索引的字段，逗号分隔 (如: uid,method)
+INDEXED_EXTRA_FIELDS = [f.strip() for f in os.getenv('INDEXED_EXTRA_FIELDS', '').split(',') if f.strip()]
+
+# 实时写入等待数据库锁的超时(秒)，超时或写入失败的日志进入磁盘暂存
+DB_WRITE_TIMEOUT = float(os.getenv('DB_WRITE_TIMEOUT', 1.0))
+
+# 磁盘暂存配置 (每个写入进程使用独立的暂存文件)
+SPOOL_PATH = os.getenv('SPOOL_PATH', 'logs.spool')
+UDP_SPOOL_PATH = os.getenv('UDP_SPOOL_PATH', 'udp_logs.spool')
+SPOOL_MAX_BYTES = int(os.getenv('SPOOL_MAX_BYTES', 256 * 1024 * 1024))
+SPOOL_FSYNC_INTERVAL = float(os.getenv('SPOOL_FSYNC_INTERVAL', 0.2))
+SPOOL_FSYNC_RECORDS = int(os.getenv('SPOOL_FSYNC_RECORDS', 500))
+
+# 边缘采集节点转发配置
+FORWARD_SPOOL_PATH = os.getenv('FORWARD_SPOOL_PATH', 'forward.spool')  # 中心节点不可达时的本地缓冲
+FORWARD_BATCH_SIZE = int(os.getenv('FORWARD_BATCH_SIZE', 500))
+FORWARD_ACK_TIMEOUT = float(os.getenv('FORWARD_ACK_TIMEOUT', 10.0))
+
+# 后台压缩配置 (清空日志后分批删除旧数据)
+COMPACTION_BATCH_ROWS = int(os.getenv('COMPACTION_BATCH_ROWS', 5000))
+COMPACTION_INTERVAL = float(os.getenv('COMPACTION_INTERVAL', 0.2))
+COMPACTION_VACUUM_PAGES = int(os.getenv('COMPACTION_VACUUM_PAGES', 256))
 
 # 日志配置
 LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
@@ -32,6 +54,9 @@ SOCKETIO_CORS_ALLOWED_ORIGINS = "*"
 MAX_BUFFER_SIZE = int(os.getenv('MAX_BUFFER_SIZE', 1000))
 BUFFER_FLUSH_INTERVAL = int(os.getenv('BUFFER_FLUSH_INTERVAL', 5))
 
+# 断线重连补发日志时每批的数量
+RESUME_BATCH_SIZE = int(os.getenv('RESUME_BATCH_SIZE', 500))
+
 # 安全配置
 ALLOWED_IPS = os.getenv('ALLOWED_IPS', '').split(',') if os.getenv('ALLOWED_IPS') else []
 RATE_LIMIT = os.getenv('RATE_LIMIT', '1000 per hour')
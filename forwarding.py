@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+边缘采集节点转发
+功能：边缘节点将解析后的日志批量压缩，通过TCP长连接发送到中心节点，中心节点确认后写入
+作者：AI助手
+版本：1.0
+
+帧格式：4字节大端长度 + zlib压缩的JSON
+  请求: {"collector_id": ..., "batch_id": ..., "records": [...]}
+  确认: {"ack": batch_id, "ok": true/false}
+"""
+
+import json
+import logging
+import socket
+import struct
+import threading
+import uuid
+import zlib
+
+from spool import LogSpool
+
+logger = logging.getLogger(__name__)
+
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+# 解压后的上限，防止压缩炸弹占满内存
+MAX_DECOMPRESSED_SIZE = 256 * 1024 * 1024
+# 转发记录中直接写入数据表列的字段，其余字段并入extra
+RECORD_FIELDS = ('timestamp', 'level', 'tag', 'message', 'source_ip',
+                 'app_package', 'hook_point', 'data_type', 'raw_data')
+
+def sanitize_record(record, collector_id):
+    """校验边缘节点发来的记录：已知列统一转为字符串，未知字段并入extra"""
+    log_data = {'collector_id': collector_id}
+    extra = record.get('extra')
+    extra = dict(extra) if isinstance(extra, dict) else ({'extra': extra} if extra is not None else {})
+
+    for key, value in record.items():
+        if key in ('id', 'collector_id', 'extra'):
+            # id由中心节点数据库分配，collector_id以连接上报的为准
+            continue
+        if key in RECORD_FIELDS:
+            if value is None:
+                continue
+            if isinstance(value, (dict, list)):
+                value = json.dumps(value, ensure_ascii=False)
+            log_data[key] = str(value)
+        elif key == 'dedup_key':
+            if value is not None:
+                log_data['dedup_key'] = str(value)
+        else:
+            extra[key] = value
+
+    if extra:
+        log_data['extra'] = extra
+    return log_data
+
+def send_frame(sock, obj):
+    """发送一帧压缩的JSON数据"""
+    payload = zlib.compress(json.dumps(obj, ensure_ascii=False).encode('utf-8'))
+    sock.sendall(struct.pack('>I', len(payload)) + payload)
+
+def _recv_exact(sock, size):
+    """读取指定长度的数据，连接关闭时返回None"""
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(min(size, 65536))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+def recv_frame(sock):
+    """接收一帧数据，连接关闭时返回None"""
+    header = _recv_exact(sock, 4)
+    if header is None:
+        return None
+    size = struct.unpack('>I', header)[0]
+    if size > MAX_FRAME_SIZE:
+        raise ValueError(f'帧长度超过上限: {size}')
+    payload = _recv_exact(sock, size)
+    if payload is None:
+        return None
+    decompressor = zlib.decompressobj()
+    data = decompressor.decompress(payload, MAX_DECOMPRESSED_SIZE)
+    if decompressor.unconsumed_tail:
+        raise ValueError(f'帧解压后超过上限: {MAX_DECOMPRESSED_SIZE}')
+    return json.loads(data)
+
+class LogForwarder:
+    """边缘节点日志转发器
+
+    日志先追加到本地暂存文件，由暂存的回放线程按顺序批量发送，
+    收到中心节点确认后才推进位置；中心节点不可达时日志留在本地等待重试。
+    """
+
+    def __init__(self, host, port, collector_id, spool_path,
+                 batch_size=500, ack_timeout=10.0):
+        self.host = host
+        self.port = port
+        self.collector_id = collector_id
+        self.ack_timeout = ack_timeout
+        self.sock = None
+        self.batch_id = 0
+        self.connected = False
+        self.stats = {
+            'forwarded': 0,
+            'batches': 0,
+            'send_errors': 0
+        }
+        # 连接失败由send_batch在状态变化时记录，暂存的重试不再重复记录
+        self.spool = LogSpool(spool_path, self.send_batch, replay_batch=batch_size, quiet_retries=True)
+
+    def forward(self, log_data):
+        """转发一条已解析的日志"""
+        log_data['collector_id'] = self.collector_id
+        # 全局唯一的去重键随记录持久化，中心节点据此丢弃确认丢失后重传的记录
+        log_data['dedup_key'] = uuid.uuid4().hex
+        if not self.spool.append(log_data):
+            logger.error("转发缓冲文件已满，日志被丢弃")
+            return False
+        return True
+
+    def _connect(self):
+        """建立到中心节点的TCP长连接"""
+        self.sock = socket.create_connection((self.host, self.port), timeout=self.ack_timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+
+    def _close(self):
+        """关闭连接，下次发送时重连"""
+        if self.sock:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
+
+    def send_batch(self, records):
+        """发送一批日志并等待确认 (由暂存回放线程调用)
+
+        失败时抛出ConnectionError，网络和中心节点的故障都是临时的，由暂存整批重试。
+        """
+        try:
+            if self.sock is None:
+                self._connect()
+
+            self.batch_id += 1
+            send_frame(self.sock, {
+                'collector_id': self.collector_id,
+                'batch_id': self.batch_id,
+                'records': records
+            })
+            reply = recv_frame(self.sock)
+            if reply is None:
+                raise ConnectionError('中心节点关闭了连接')
+            if reply.get('ack') != self.batch_id or not reply.get('ok'):
+                raise ConnectionError(f'中心节点未确认批次 {self.batch_id}: {reply}')
+
+            if not self.connected:
+                logger.info(f"已连接到中心节点 {self.host}:{self.port}")
+                self.connected = True
+            self.stats['forwarded'] += len(records)
+            self.stats['batches'] += 1
+
+        except (OSError, ValueError, zlib.error) as e:
+            # 只在状态变化时记录，避免中心节点长时间不可达时刷屏
+            if self.connected or self.stats['send_errors'] == 0:
+                logger.warning(f"转发到中心节点失败，日志暂存在本地: {e}")
+            self.connected = False
+            self.stats['send_errors'] += 1
+            self._close()
+            raise ConnectionError(str(e)) from e
+
+    def get_stats(self):
+        """获取转发统计信息"""
+        stats = dict(self.stats)
+        stats['connected'] = self.connected
+        stats['spool'] = self.spool.get_stats()
+        return stats
+
+    def close(self):
+        """停止转发"""
+        self.spool.close()
+        self._close()
+
+class ForwardReceiver:
+    """中心节点接收端：接收边缘节点转发的日志批次并写入"""
+
+    def __init__(self, host, port, handler):
+        self.host = host
+        self.port = port
+        self.handler = handler  # 批量写入函数，成功返回True
+        self.socket = None
+        self.running = False
+
+    def start(self):
+        """在后台线程中启动监听"""
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((self.host, self.port))
+        self.socket.listen(64)
+        self.running = True
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+        logger.info(f"转发接收端监听: {self.host}:{self.port}")
+
+    def _accept_loop(self):
+        """接受边缘节点连接"""
+        while self.running:
+            try:
+                conn, addr = self.socket.accept()
+            except OSError:
+                break
+            threading.Thread(target=self._handle_connection, args=(conn, addr), daemon=True).start()
+
+    def _handle_connection(self, conn, addr):
+        """处理一个边缘节点的长连接"""
+        logger.info(f"采集节点已连接: {addr[0]}:{addr[1]}")
+        try:
+            while self.running:
+                frame = recv_frame(conn)
+                if frame is None:
+                    break
+                ok = self._handle_batch(frame, addr)
+                send_frame(conn, {'ack': frame.get('batch_id'), 'ok': ok})
+        except (OSError, ValueError, zlib.error) as e:
+            logger.warning(f"采集节点连接异常 {addr[0]}: {e}")
+        finally:
+            conn.close()
+            logger.info(f"采集节点已断开: {addr[0]}:{addr[1]}")
+
+    def _handle_batch(self, frame, addr):
+        """写入一个批次，返回是否成功
+
+        重传的记录带有相同的dedup_key，由数据库唯一索引去重，
+        中心节点重启或边缘节点换了新数据库都不影响去重。
+        """
+        collector_id = str(frame.get('collector_id') or addr[0])
+        records = [sanitize_record(record, collector_id)
+                   for record in frame.get('records') or [] if isinstance(record, dict)]
+
+        if records and not self.handler(records):
+            return False
+        return True
+
+    def stop(self):
+        """停止监听"""
+        self.running = False
+        if self.socket:
+            self.socket.close()
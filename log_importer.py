@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+离线日志批量导入工具
+功能：将保存到磁盘的Xposed/logcat日志文件批量导入数据库
+作者：AI助手
+版本：1.0
+"""
+
+import gzip
+import logging
+import mmap
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+# 导入主应用的日志处理函数
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from app import LogDatabase, process_xposed_log
+from config import DATABASE_PATH
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024  # 每个分块8MB
+
+# 行首时间戳，兼容以下格式:
+#   logcat threadtime:   10-19 00:01:02.345  1234  5678 I Tag: msg
+#   logcat -v year:      2026-10-19 00:01:02.345  1234  5678 I Tag: msg
+#   LSPosed:             [ 2026-10-19T00:01:02.345  1000: 1234: 5678 I/LSPosed-Bridge ] msg
+LINE_TIMESTAMP_PATTERN = re.compile(
+    r'^\[?\s*(?:(?P<year>\d{4})-)?(?P<month>\d{2})-(?P<day>\d{2})[T ]\s*'
+    r'(?P<time>\d{2}:\d{2}:\d{2})(?P<fraction>\.\d{1,6})?'
+)
+
+def parse_line_timestamp(line, default_year):
+    """解析行首的logcat/Xposed时间戳，返回ISO格式字符串，没有时间戳时返回None"""
+    match = LINE_TIMESTAMP_PATTERN.match(line)
+    if not match:
+        return None
+    year = int(match.group('year') or default_year)
+    fraction = (match.group('fraction') or '.0')[1:].ljust(6, '0')
+    try:
+        parsed = datetime.strptime(
+            f"{year}-{match.group('month')}-{match.group('day')} {match.group('time')}.{fraction}",
+            '%Y-%m-%d %H:%M:%S.%f'
+        )
+    except ValueError:
+        return None
+    return parsed.isoformat()
+
+def _parse_line(line, source_ip, default_year):
+    """解析一行日志，分类规则与实时UDP日志一致，时间使用日志自带的时间戳"""
+    log_data = process_xposed_log(line, source_ip)
+    # 结构化日志已从payload中取得时间戳；文本日志用行首时间戳，没有时才使用导入时间
+    if not line.startswith('{'):
+        timestamp = parse_line_timestamp(line, default_year)
+        if timestamp:
+            log_data['timestamp'] = timestamp
+    return log_data
+
+def _parse_block(data, source_ip, default_year):
+    """解析一块日志数据"""
+    text = data.decode('utf-8', errors='ignore')
+    return [_parse_line(line.strip(), source_ip, default_year) for line in text.split('\n') if line.strip()]
+
+def _parse_file_range(path, start, end, source_ip, default_year):
+    """在子进程中内存映射文件并解析[start, end)范围"""
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return _parse_block(mm[start:end], source_ip, default_year)
+
+def iter_file_ranges(path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """按换行符对齐切分文件，返回(start, end)偏移量"""
+    size = os.path.getsize(path)
+    if size == 0:
+        return
+
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            start = 0
+            while start < size:
+                end = min(start + chunk_size, size)
+                if end < size:
+                    newline = mm.find(b'\n', end)
+                    end = size if newline == -1 else newline + 1
+                yield start, end
+                start = end
+
+def iter_gzip_blocks(path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """流式解压gzip文件，按换行符对齐返回数据块"""
+    remainder = b''
+    with gzip.open(path, 'rb') as f:
+        while True:
+            block = f.read(chunk_size)
+            if not block:
+                break
+            block = remainder + block
+            cut = block.rfind(b'\n')
+            if cut == -1:
+                remainder = block
+                continue
+            remainder = block[cut + 1:]
+            yield block[:cut + 1]
+    if remainder:
+        yield remainder
+
+def import_file(path, db, source_ip='import', workers=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """导入单个日志文件，返回统计信息"""
+    is_gzip = path.endswith('.gz')
+    stats = {'lines': 0, 'errors': 0, 'chunks': 0}
+    start_time = time.time()
+    last_report = start_time
+    # logcat时间戳不带年份，使用文件修改时间的年份 (通常为抓取结束时间)
+    default_year = datetime.fromtimestamp(os.path.getmtime(path)).year
+
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        if is_gzip:
+            tasks = ((_parse_block, block, source_ip, default_year)
+                     for block in iter_gzip_blocks(path, chunk_size))
+        else:
+            tasks = ((_parse_file_range, path, start, end, source_ip, default_year)
+                     for start, end in iter_file_ranges(path, chunk_size))
+
+        # 限制在途分块数量，避免大文件一次性读入内存
+        max_pending = workers * 2
+        pending = []
+
+        def drain(future):
+            log_list = future.result()
+            # 每个分块一个事务
+            if db.insert_logs(log_list):
+                stats['lines'] += len(log_list)
+            else:
+                stats['errors'] += len(log_list)
+            stats['chunks'] += 1
+
+        for func, *args in tasks:
+            pending.append(executor.submit(func, *args))
+            if len(pending) >= max_pending:
+                drain(pending.pop(0))
+
+            now = time.time()
+            if now - last_report >= 5:
+                last_report = now
+                logger.info(f"已导入 {stats['lines']} 行, {stats['lines'] / (now - start_time):.0f} 行/秒")
+
+        for future in pending:
+            drain(future)
+
+    stats['seconds'] = time.time() - start_time
+    stats['lines_per_sec'] = stats['lines'] / stats['seconds'] if stats['seconds'] > 0 else 0
+    return stats
+
+def import_files(paths, db, defer_indexes=None, **kwargs):
+    """导入多个日志文件，返回每个文件的统计信息
+
+    defer_indexes: 导入期间是否删除索引；为None时仅在数据库为空时删除，
+    避免正在使用的查看器数据库在导入期间退化为全表扫描。
+    索引在所有文件导入前删除一次，全部完成后重建一次。
+    """
+    if defer_indexes is None:
+        defer_indexes = db.get_last_log_id() == 0
+    if defer_indexes:
+        # 批量导入期间不维护二级索引，导入完成后统一重建
+        db.drop_indexes()
+
+    results = []
+    try:
+        for path in paths:
+            logger.info(f"开始导入: {path}")
+            result = import_file(path, db, **kwargs)
+            logger.info(
+                f"导入完成: {path} - {result['lines']} 行, 失败 {result['errors']} 行, "
+                f"耗时 {result['seconds']:.1f} 秒, {result['lines_per_sec']:.0f} 行/秒"
+            )
+            results.append(result)
+    finally:
+        if defer_indexes:
+            logger.info("正在重建索引...")
+            db.create_indexes()
+    return results
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='离线日志批量导入工具')
+    parser.add_argument('files', nargs='+', help='日志文件路径 (支持.gz压缩文件)')
+    parser.add_argument('--db', default=DATABASE_PATH, help=f'数据库路径 (默认: {DATABASE_PATH})')
+    parser.add_argument('--source', default='import', help='写入source_ip字段的来源标识 (默认: import)')
+    parser.add_argument('--workers', type=int, default=None, help='解析进程数 (默认: CPU核数)')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='分块大小，字节 (默认: 8MB)')
+    parser.add_argument('--defer-indexes', action='store_true',
+                        help='导入期间删除索引、完成后重建 (默认仅在数据库为空时启用；导入期间查询会变慢)')
+
+    args = parser.parse_args()
+
+    database = LogDatabase(args.db)
+    import_files(
+        args.files,
+        database,
+        defer_indexes=True if args.defer_indexes else None,
+        source_ip=args.source,
+        workers=args.workers,
+        chunk_size=args.chunk_size
+    )
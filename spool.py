@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+磁盘暂存队列
+功能：数据库不可用(锁定/磁盘满)时将日志追加写入本地文件，恢复后按顺序回放
+作者：AI助手
+版本：1.0
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class LogSpool:
+    """只追加的日志暂存文件
+
+    每行一条JSON记录，批量fsync；已回放的位置记录在 <path>.offset 中。
+    回放提交后、偏移量落盘前崩溃会导致少量记录重复写入(至少一次语义)。
+    写入遇到临时错误时整批重试；其他错误二分定位出有问题的记录，
+    移入 <path>.dead 后继续回放，避免一条坏记录阻塞整个暂存队列。
+    """
+
+    def __init__(self, path, writer, max_bytes=256 * 1024 * 1024, fsync_interval=0.2,
+                 fsync_records=500, replay_batch=500, retry_interval=1.0, is_transient=None,
+                 quiet_retries=False):
+        self.path = path
+        self.offset_path = path + '.offset'
+        self.dead_path = path + '.dead'
+        self.writer = writer  # 批量写入函数，失败时抛出异常
+        self.is_transient = is_transient or (lambda error: True)  # 判断异常是否可重试
+        self.quiet_retries = quiet_retries  # 写入方自己记录失败时，重试只输出debug日志
+        self.max_bytes = max_bytes
+        self.fsync_interval = fsync_interval
+        self.fsync_records = fsync_records
+        self.replay_batch = replay_batch
+        self.retry_interval = retry_interval
+
+        self.lock = threading.Lock()
+        self.replay_event = threading.Event()
+        self.unsynced = 0
+        self.running = True
+        self.stats = {
+            'spooled': 0,
+            'replayed': 0,
+            'dropped': 0,
+            'recovered': 0,
+            'dead_lettered': 0
+        }
+
+        self._recover()
+        self.file = open(self.path, 'ab')
+
+        threading.Thread(target=self._fsync_worker, daemon=True).start()
+        threading.Thread(target=self._replay_worker, daemon=True).start()
+
+    @property
+    def pending(self):
+        """是否还有未回放的记录，有则新日志也应进入暂存以保持顺序"""
+        return self.offset < self.size
+
+    def _recover(self):
+        """启动时恢复：截断不完整的尾部记录，读取回放位置"""
+        self.size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        self.offset = 0
+
+        if self.size > 0:
+            with open(self.path, 'r+b') as f:
+                # 崩溃可能留下写了一半的最后一行，向前逐块查找最后一个换行符
+                f.seek(self.size - 1)
+                if f.read(1) != b'\n':
+                    end = self.size
+                    cut = -1
+                    while end > 0 and cut == -1:
+                        start = max(0, end - 65536)
+                        f.seek(start)
+                        cut = f.read(end - start).rfind(b'\n')
+                        if cut != -1:
+                            cut += start
+                        end = start
+                    self.size = cut + 1
+                    f.truncate(self.size)
+                    logger.warning(f"暂存文件尾部记录不完整，已截断到 {self.size} 字节")
+
+        try:
+            with open(self.offset_path, 'r') as f:
+                self.offset = int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            self.offset = 0
+        if self.offset > self.size:
+            self.offset = self.size
+
+        if self.pending:
+            self.stats['recovered'] = self.size - self.offset
+            logger.info(f"发现未回放的暂存日志 {self.size - self.offset} 字节，将在数据库可用后回放")
+
+    def _save_offset(self):
+        """原子写入回放位置"""
+        temp_path = self.offset_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            f.write(str(self.offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.offset_path)
+
+    def _fsync(self):
+        """刷新并同步到磁盘 (需持有锁)"""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+
+    def append(self, log_data):
+        """追加一条日志，超出容量上限时丢弃并返回False"""
+        return self.append_many([log_data])
+
+    def append_many(self, log_list):
+        """追加一批日志，全部写入或全部丢弃，避免发送方重试时重复暂存已写入的部分"""
+        data = b''.join(json.dumps(log_data, ensure_ascii=False).encode('utf-8') + b'\n'
+                        for log_data in log_list)
+        with self.lock:
+            if self.size + len(data) > self.max_bytes:
+                self.stats['dropped'] += len(log_list)
+                return False
+
+            self.file.write(data)
+            self.size += len(data)
+            self.unsynced += len(log_list)
+            self.stats['spooled'] += len(log_list)
+            if self.unsynced >= self.fsync_records:
+                self._fsync()
+
+        self.replay_event.set()
+        return True
+
+    def _fsync_worker(self):
+        """定期批量fsync"""
+        while self.running:
+            time.sleep(self.fsync_interval)
+            try:
+                with self.lock:
+                    if self.unsynced:
+                        self._fsync()
+            except Exception as e:
+                # 磁盘暂时写满等错误，下一轮继续同步
+                logger.error(f"暂存文件同步失败: {e}")
+                time.sleep(self.retry_interval)
+
+    def _read_batch(self, end):
+        """从回放位置读取一批完整记录，返回(记录列表, 读取字节数)"""
+        records = []
+        consumed = 0
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            while len(records) < self.replay_batch and self.offset + consumed < end:
+                line = f.readline()
+                if not line.endswith(b'\n'):
+                    break
+                consumed += len(line)
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    self.stats['dropped'] += 1
+        return records, consumed
+
+    def _dead_letter(self, record, error):
+        """将无法写入的记录移入死信文件"""
+        line = json.dumps({'error': str(error), 'record': record}, ensure_ascii=False).encode('utf-8') + b'\n'
+        with open(self.dead_path, 'ab') as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+        self.stats['dead_lettered'] += 1
+        logger.error(f"暂存记录无法写入，已移入 {self.dead_path}: {error}")
+
+    def _write(self, records):
+        """写入一批记录，返回移入死信文件的记录数；临时错误时抛出异常"""
+        try:
+            self.writer(records)
+            return 0
+        except Exception as e:
+            if self.is_transient(e):
+                raise
+            if len(records) == 1:
+                self._dead_letter(records[0], e)
+                return 1
+
+        # 非临时错误：二分定位有问题的记录，其余记录照常写入
+        middle = len(records) // 2
+        return self._write(records[:middle]) + self._write(records[middle:])
+
+    def _replay_worker(self):
+        """数据库恢复后按顺序回放暂存记录"""
+        while self.running:
+            self.replay_event.wait(self.retry_interval)
+            self.replay_event.clear()
+
+            while self.running and self.pending:
+                try:
+                    if not self._replay_batch():
+                        break
+                except Exception as e:
+                    # 读取暂存文件或保存回放位置失败(如磁盘暂时写满)，回放线程不能退出
+                    logger.error(f"暂存回放出错，稍后重试: {e}")
+                    time.sleep(self.retry_interval)
+
+    def _replay_batch(self):
+        """回放一批记录，没有可读的完整记录时返回False"""
+        with self.lock:
+            self.file.flush()
+            end = self.size
+
+        records, consumed = self._read_batch(end)
+        if consumed == 0:
+            return False
+        try:
+            dead = self._write(records) if records else 0
+        except Exception as e:
+            # 数据库仍不可用，稍后整批重试
+            log = logger.debug if self.quiet_retries else logger.warning
+            log(f"回放暂存日志失败，稍后重试: {e}")
+            time.sleep(self.retry_interval)
+            return True
+
+        with self.lock:
+            self.offset += consumed
+            self.stats['replayed'] += len(records) - dead
+            if self.offset >= self.size:
+                # 全部回放完成，清空暂存文件
+                self.file.truncate(0)
+                self.size = 0
+                self.offset = 0
+            self._save_offset()
+
+        if records:
+            logger.info(f"已回放暂存日志 {len(records)} 条")
+        return True
+
+    def get_stats(self):
+        """获取暂存统计信息"""
+        with self.lock:
+            stats = dict(self.stats)
+            stats['pending_bytes'] = self.size - self.offset
+        return stats
+
+    def close(self):
+        """停止后台线程并同步文件"""
+        self.running = False
+        self.replay_event.set()
+        with self.lock:
+            self._fsync()
+            self.file.close()
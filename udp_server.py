@@ -9,7 +9,6 @@ UDP日志接收服务器
 
 import socket
 import threading
-import json
 import time
 import logging
 from datetime import datetime
@@ -18,7 +17,11 @@ import os
 
 # 导入主应用的日志处理函数
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-from app import add_log_to_system
+import app
+from app import (add_log_to_system, add_logs_to_system, init_spool, process_xposed_log,
+                 normalize_level, parse_structured_payload)
+from config import UDP_SPOOL_PATH, FORWARD_SPOOL_PATH, FORWARD_BATCH_SIZE, FORWARD_ACK_TIMEOUT
+from forwarding import LogForwarder, ForwardReceiver
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -27,9 +30,10 @@ logger = logging.getLogger(__name__)
 class UDPLogServer:
     """UDP日志接收服务器"""
     
-    def __init__(self, host='0.0.0.0', port=9999):
+    def __init__(self, host='0.0.0.0', port=9999, forwarder=None):
         self.host = host
         self.port = port
+        self.forwarder = forwarder  # 转发模式：日志发送到中心节点而不写本地数据库
         self.socket = None
         self.running = False
         self.stats = {
@@ -102,8 +106,7 @@ class UDPLogServer:
             for line in lines:
                 line = line.strip()
                 if line:
-                    # 直接添加原始文本到日志系统
-                    add_log_to_system(line, addr[0])
+                    self._handle_line(line, addr[0])
                     self.stats['total_processed'] += 1
             
         except UnicodeDecodeError as e:
@@ -112,7 +115,7 @@ class UDPLogServer:
             try:
                 raw_message = data.decode('gbk', errors='ignore')
                 if raw_message.strip():
-                    add_log_to_system(raw_message.strip(), addr[0])
+                    self._handle_line(raw_message.strip(), addr[0])
                     self.stats['total_processed'] += 1
             except:
                 self.stats['errors'] += 1
@@ -120,6 +123,13 @@ class UDPLogServer:
             logger.error(f"处理数据失败: {e}")
             self.stats['errors'] += 1
     
+    def _handle_line(self, line, source_ip):
+        """处理一行日志：转发模式发往中心节点，否则直接添加原始文本到日志系统"""
+        if self.forwarder:
+            self.forwarder.forward(process_xposed_log(line, source_ip))
+        else:
+            add_log_to_system(line, source_ip)
+    
     def _stats_reporter(self):
         """定期报告统计信息"""
         while self.running:
@@ -134,6 +144,14 @@ class UDPLogServer:
                 logger.info(f"错误总数: {self.stats['errors']}")
                 logger.info(f"客户端数: {len(self.stats['clients'])}")
                 logger.info(f"客户端IP: {', '.join(self.stats['clients'])}")
+                if self.forwarder:
+                    forward_stats = self.forwarder.get_stats()
+                    logger.info(f"转发: {forward_stats['forwarded']} 条, 连接: {forward_stats['connected']}, "
+                                f"本地积压 {forward_stats['spool']['pending_bytes']} 字节")
+                if app.spool is not None:
+                    spool_stats = app.spool.get_stats()
+                    logger.info(f"暂存/回放/丢弃: {spool_stats['spooled']}/{spool_stats['replayed']}/{spool_stats['dropped']}, "
+                                f"积压 {spool_stats['pending_bytes']} 字节")
                 logger.info("==================")
     
     def stop(self):
@@ -191,9 +209,10 @@ class XposedLogFormatter:
     def parse_structured_log(log_string):
         """解析结构化日志"""
         try:
-            # 尝试解析JSON格式
-            if log_string.startswith('{') and log_string.endswith('}'):
-                return json.loads(log_string)
+            # JSON格式与实时日志使用同一个检测函数
+            payload = parse_structured_payload(log_string)
+            if payload is not None:
+                return payload
             
             # 尝试解析自定义格式: [LEVEL] TAG: MESSAGE
             import re
@@ -203,7 +222,7 @@ class XposedLogFormatter:
             if match:
                 level, tag, message = match.groups()
                 return {
-                    'level': level.upper(),
+                    'level': normalize_level(level),
                     'tag': tag,
                     'message': message
                 }
@@ -258,13 +277,36 @@ if __name__ == '__main__':
     parser.add_argument('--host', default='0.0.0.0', help='监听地址 (默认: 0.0.0.0)')
     parser.add_argument('--port', type=int, default=9999, help='监听端口 (默认: 9999)')
     parser.add_argument('--test', action='store_true', help='运行测试模式')
+    parser.add_argument('--spool', default=UDP_SPOOL_PATH, help=f'数据库不可用时的暂存文件 (默认: {UDP_SPOOL_PATH})')
+    parser.add_argument('--forward', metavar='HOST:PORT', help='转发模式: 将日志发送到中心节点，不写本地数据库')
+    parser.add_argument('--collector-id', default=socket.gethostname(), help='转发模式下的采集节点标识 (默认: 主机名)')
+    parser.add_argument('--receive-port', type=int, help='中心节点: 接收采集节点转发日志的TCP端口')
     
     args = parser.parse_args()
     
+    forwarder = None
+    if args.forward:
+        forward_host, forward_port = args.forward.rsplit(':', 1)
+        forwarder = LogForwarder(
+            forward_host,
+            int(forward_port),
+            args.collector_id,
+            FORWARD_SPOOL_PATH,
+            batch_size=FORWARD_BATCH_SIZE,
+            ack_timeout=FORWARD_ACK_TIMEOUT
+        )
+        logger.info(f"转发模式: 采集节点 {args.collector_id} -> {args.forward}")
+    else:
+        init_spool(args.spool)
+    
+    if args.receive_port:
+        receiver = ForwardReceiver(args.host, args.receive_port, add_logs_to_system)
+        receiver.start()
+    
     if args.test:
         print("启动测试模式...")
         # 启动服务器
-        server = UDPLogServer(args.host, args.port)
+        server = UDPLogServer(args.host, args.port, forwarder)
         server_thread = threading.Thread(target=server.start, daemon=True)
         server_thread.start()
         
@@ -283,7 +325,7 @@ if __name__ == '__main__':
             server.stop()
     else:
         # 正常启动服务器
-        server = UDPLogServer(args.host, args.port)
+        server = UDPLogServer(args.host, args.port, forwarder)
         
         try:
             server.start()